@@ -67,8 +67,6 @@ class Chord:
         print(self.base, idx, symbol, idx_symbol)
         return (idx_symbol - idx) % 12
 
-key_shift = 0
-
 parser = argparse.ArgumentParser()
 parser.add_argument("file")
 key_group = parser.add_mutually_exclusive_group()
@@ -83,10 +81,14 @@ parser.add_argument("-o", "--output-folder", default="./", help="if in pdf mode
 parser.add_argument("-l", "--lyrics", action="store_true", help="only print the lyrics")
 parser.add_argument("-v", "--verbose", action="store_true", help="add verbosity")
 
-args = parser.parse_args()
+args = None
 
-if args.pdf:
-    args.no_color = True
+def parse_args(argv=None):
+    global args
+    args = parser.parse_args(argv)
+    if args.pdf:
+        args.no_color = True
+    return args
 
 
 def match_after(expr, target):
@@ -338,13 +340,44 @@ def pdf(body,title,artist,key):
     if args.output_folder != "./":
         os.chdir(cwd)
 
-with open(os.path.expanduser(args.file), "r") as textfile:
-    text = textfile.readlines()
+CHORD = r"\[[a-zA-Z0-9#/]+\]"
+
+def read_song(filename):
+    with open(os.path.expanduser(filename), "r") as textfile:
+        text = textfile.readlines()
     body = "".join(text[text.index("---\n")+1:])
     text = "".join(text[:text.index("---\n")])
     title = match_after("(?<=^# ).*", text)
     artist = match_after("(?<=^## ).*", text)
     key = match_after("(?<=^### ).*", text)
+    return title, artist, key, body
+
+# words of the lyrics without chords, sheet and chord progression lines
+def lyrics(body):
+    text = re.sub(CHORD, "", body)
+    lines = [line for line in text.splitlines() if not line.startswith(('>', '|'))]
+    return re.findall(r"\w+", "\n".join(lines).lower())
+
+# chords as steps above the written key, equal for a song in every key
+def chord_sequence(body, key):
+    try:
+        root = Chord(re.split(r"[+-]", key)[0].strip()).index()
+    except (ValueError, TypeError, IndexError):
+        root = 0
+    sequence = []
+    for symbol in re.findall(CHORD, body):
+        try:
+            chord = Chord(symbol[1:-1])
+            idx = chord.index()
+        except (ValueError, TypeError):
+            continue
+        sequence.append("{}{}{}".format((idx - root) % 12, "" if chord.third else "m", chord.addition.split('/')[0]))
+    return sequence
+
+# read, parse and transpose a song according to args
+def load(filename):
+    title, artist, key, body = read_song(filename)
+    key_shift = 0
     key_shift_symbol = '+'
 
     if "+" in key:
@@ -368,8 +401,6 @@ with open(os.path.expanduser(args.file), "r") as textfile:
     else:
         key_shift = 0
         key = str(key)
-    print("{} - {} ({})".format(title, artist, key))
-    
 
     # transpose
     def trans(matchobject):
@@ -377,13 +408,26 @@ with open(os.path.expanduser(args.file), "r") as textfile:
         return "[" + str(Chord(chord).transpose(key_shift)) + "]"
     if args.transpose is not None or args.transposed:
         if key_shift != 0:
-            body = re.sub(r"\[[a-zA-Z0-9#/]+\]", trans, body)
+            body = re.sub(CHORD, trans, body)
     elif args.no_chords:
-        body = re.sub(r"\[[a-zA-Z0-9#/]+\]", "", body)
+        body = re.sub(CHORD, "", body)
+    return title, artist, key, body
+
+def header(title, artist, key):
+    return "{} - {} ({})".format(title, artist, key)
+
+# terminal view of a loaded body
+def render(body):
+    if '>' in body:
+        return sheet(body)
+    return out(body) + "\n"
+
+if __name__ == "__main__":
+    parse_args()
+    title, artist, key, body = load(args.file)
+    print(header(title, artist, key))
 
     if args.pdf:
         pdf(body,title,artist,key)
-    elif '>' in body:
-        print(sheet(body),end='')
     else:
-        print(out(body))
+        print(render(body),end='')
@@ -8,7 +8,10 @@ import re
 import subprocess
 import json
 import hashlib
+import shlex
+import random
 
+from collections import OrderedDict
 from shutil import copy as copy_file
 
 from prompt_toolkit import prompt
@@ -20,6 +23,11 @@ from prompt_toolkit.key_binding import KeyBindings
 from prompt_toolkit.formatted_text import HTML
 from prompt_toolkit.styles import Style
 
+try:
+    import lyr
+except ImportError:
+    lyr = None
+
 # metadata in json file for searching 
 
 COMMANDS = {"src,cd": 'set source folder',
@@ -30,9 +38,20 @@ COMMANDS = {"src,cd": 'set source folder',
             "new": 'create a new lyrics sheet from a template',
             'ed,vim': 'edit file',
             "status": 'print list of changed files',
+            "dupes": 'list songs that are probably duplicates',
             "q": 'quit',
             "h,?": 'help'}
 
+VIEW_CACHE_SIZE = 32
+
+# near-duplicate detection: minhash signatures split into bands for locality-sensitive hashing
+FINGERPRINT_SIZE = 64
+LSH_BANDS = 16
+DUPE_THRESHOLD = 0.5
+MINHASH_PRIME = (1 << 61) - 1
+_rng = random.Random(0) # fixed seed, cached fingerprints have to stay comparable
+MINHASH_SEEDS = [(_rng.randrange(1, MINHASH_PRIME), _rng.randrange(MINHASH_PRIME)) for _ in range(FINGERPRINT_SIZE)]
+
 COMMAND_KEYS = []
 for key in COMMANDS.keys():
     for item in key.split(','):
@@ -51,6 +70,7 @@ src_root = args.src
 out = args.out
 conf_dir = args.conf
 editor = args.editor
+view_cache = OrderedDict()
 
 prompt_style = Style.from_dict({'prompt': 'bg:ansiyellow fg:ansiblack', 
                                 'path': 'fg:ansiblue bg:ansiblack', 
@@ -84,14 +104,17 @@ def filter_suggestions(file_list):
             output.append(f[:-3])
     return sorted(output)
 
+def get_md_args(md_file):
+    with open(md_file) as md:
+        md_args = md.readline()
+    if md_args.startswith('#!/bin/lyr'):
+        return md_args[11:].replace('\n','')
+    return ""
+
 def build_lyr_command(filename, args):
     dirname = os.path.split(filename)[0]
     md_file = os.path.join(src,filename)
-    md_args = ""
-    with open(md_file) as md:
-        md_args = md.readline()
-        if md_args.startswith('#!/bin/lyr'):
-            md_args = md_args[11:].replace('\n','')
+    md_args = get_md_args(md_file)
     # smuggle in the default out option as first argument to allow overriding later on
     md_args = "-o {} {}".format(os.path.normpath(os.path.join(out,os.path.relpath(src,src_root),dirname)), md_args)
     lyr_command = "/bin/lyr {} {} {}".format(md_file,md_args,args)
@@ -107,6 +130,107 @@ def sha256(filename):
             h.update(chunk)
     return h.hexdigest()
 
+def render_view(filename, args):
+    # render in-process, reopening an unchanged song with the same view is served from the cache
+    md_file = os.path.join(src,filename)
+    lyr_args = lyr.parse_args([md_file] + shlex.split(get_md_args(md_file)) + shlex.split(args))
+    if lyr_args.pdf:
+        return None
+    key = (sha256(md_file), lyr_args.transpose, lyr_args.transposed, lyr_args.no_chords,
+           lyr_args.sheet, lyr_args.lyrics, lyr_args.no_color, tuple(os.get_terminal_size()))
+    if key in view_cache:
+        view_cache.move_to_end(key)
+        return view_cache[key]
+    title, artist, song_key, body = lyr.load(md_file)
+    view = lyr.header(title, artist, song_key) + "\n" + lyr.render(body)
+    view_cache[key] = view
+    if len(view_cache) > VIEW_CACHE_SIZE:
+        view_cache.popitem(last=False)
+    return view
+
+def shingles(tokens, n):
+    if len(tokens) < n:
+        return {" ".join(tokens)} if tokens else set()
+    return {" ".join(tokens[i:i+n]) for i in range(len(tokens)-n+1)}
+
+def minhash(shingle_set):
+    if not shingle_set:
+        return []
+    hashes = [int.from_bytes(hashlib.blake2b(s.encode(), digest_size=8).digest(), 'big') for s in shingle_set]
+    return [min((a*h + b) % MINHASH_PRIME for h in hashes) for a,b in MINHASH_SEEDS]
+
+def similarity(sig_a, sig_b):
+    if not sig_a or not sig_b:
+        return 0.0
+    return sum(a == b for a,b in zip(sig_a,sig_b)) / FINGERPRINT_SIZE
+
+def fingerprint(md_file):
+    _, _, key, body = lyr.read_song(md_file)
+    return {"lyrics": minhash(shingles(lyr.lyrics(body), 3)),
+            "chords": minhash(shingles(lyr.chord_sequence(body, key), 4))}
+
+def valid_fingerprint(fp, h):
+    if not isinstance(fp, dict) or fp.get("sha256") != h:
+        return False
+    for kind in ("lyrics", "chords"):
+        sig = fp.get(kind)
+        if not isinstance(sig, list) or len(sig) not in (0, FINGERPRINT_SIZE):
+            return False
+    return True
+
+def get_fingerprints():
+    fingerprints = dict()
+    fp_file = os.path.join(conf_dir,"fingerprints.json")
+    if os.path.isfile(fp_file):
+        try:
+            with open(fp_file, 'r') as js:
+                fingerprints = json.load(js)
+        except (OSError, ValueError): # unreadable cache, recompute everything
+            pass
+    if not isinstance(fingerprints, dict):
+        fingerprints = dict()
+    # only fingerprint new and changed files, drop removed ones
+    current = dict()
+    for root, _, files in os.walk(src_root):
+        for name in files:
+            if name.endswith(".md") and not name == "README.md":
+                filename = get_relpath(os.path.join(root, name))
+                h = sha256(os.path.join(root, name))
+                if valid_fingerprint(fingerprints.get(filename), h):
+                    current[filename] = fingerprints[filename]
+                    continue
+                try:
+                    current[filename] = fingerprint(os.path.join(root, name))
+                except (ValueError, TypeError, IndexError):
+                    # empty signatures never share a bucket, the error is only reported until the file changes
+                    message('e', "{} could not be parsed".format(filename))
+                    current[filename] = {"lyrics": [], "chords": []}
+                current[filename]["sha256"] = h
+    with open(fp_file, 'w') as js:
+        json.dump(current,js,indent=4)
+    return current
+
+def find_dupes(fingerprints):
+    # only songs sharing a band of their lyrics signature are compared
+    rows = FINGERPRINT_SIZE // LSH_BANDS
+    buckets = dict()
+    for filename, fp in fingerprints.items():
+        sig = fp["lyrics"]
+        for band in range(0, len(sig), rows):
+            buckets.setdefault((band, tuple(sig[band:band+rows])), []).append(filename)
+    candidates = set()
+    for files in buckets.values():
+        for i, a in enumerate(files):
+            for b in files[i+1:]:
+                candidates.add(tuple(sorted((a,b))))
+    dupes = []
+    for a,b in candidates:
+        lyrics_sim = similarity(fingerprints[a]["lyrics"], fingerprints[b]["lyrics"])
+        if lyrics_sim >= DUPE_THRESHOLD:
+            chords_sim = similarity(fingerprints[a]["chords"], fingerprints[b]["chords"])
+            dupes.append((lyrics_sim, chords_sim, a, b))
+    return sorted(dupes, reverse=True)
+
 def get_changed_files():
     out = []
     hashes = dict()
@@ -192,6 +316,19 @@ while True:
                     message("e", "leaving the root is not allowed")
 
         elif cmd in src_files:
+            view = None
+            if lyr is not None:
+                try:
+                    view = render_view(md(cmd), args)
+                except SystemExit: # invalid arguments, argparse already printed the error
+                    continue
+                except (ValueError, TypeError, IndexError) as e: # malformed song, keep the session alive
+                    message('e', "{} could not be rendered: {}".format(md(cmd), e))
+                    continue
+            if view is not None:
+                print(view,end='')
+                input()
+                continue
             lyr_command = build_lyr_command(md(cmd), args)
             # print(lyr_command)
             subprocess.call(lyr_command, shell=True)
@@ -289,6 +426,16 @@ while True:
                 else:
                     print(x)
 
+        elif cmd == "dupes":
+            if lyr is None:
+                message('e', "lyr could not be imported")
+                continue
+            dupes = find_dupes(get_fingerprints())
+            if len(dupes) == 0:
+                message('o', 'no duplicates found')
+            for lyrics_sim, chords_sim, a, b in dupes:
+                print("{:4.0%} lyrics {:4.0%} chords  {}  {}".format(lyrics_sim, chords_sim, a, b))
+
         elif cmd != '':
             message('e', "unknown command")
 